@@ -1,13 +1,10 @@
 import sys
 import typer
 from pathlib import Path
-from typing import List, Optional, Set
-from jinja2 import Environment, FileSystemLoader, meta, Undefined
+from typing import List, Optional
 
 from .console import state, rich_echo, rich_debug
-from .config import load_raw_context, execute_plan
-from .processor import process_value
-from .tracker import create_tracking_context
+from .utils import walk_files
 
 TEMPLATES_DIR_NAME = "templates"
 OUTPUTS_DIR_NAME = "outputs"
@@ -18,16 +15,17 @@ app = typer.Typer(
     rich_markup_mode="markdown"
 )
 
-# 使用一个静默的 Undefined，防止在追踪阶段因为访问了未定义变量而报错
-class SilentUndefined(Undefined):
-    def __getattr__(self, name):
-        return SilentUndefined()
-    def __getitem__(self, key):
-        return SilentUndefined()
-    def __str__(self):
-        return ""
-    def __bool__(self):
-        return False
+def _render_template_file(env, record, render_context) -> Optional[Exception]:
+    """
+    渲染单个模板并写入其输出文件 (输出目录需已创建)。
+    在线程池中执行，失败时把异常返回给主线程统一输出。
+    """
+    try:
+        output_content = env.get_template(record.load_name).render(render_context)
+        record.output_path.write_text(output_content, encoding='utf-8')
+    except Exception as e:
+        return e
+    return None
 
 @app.command()
 def render(
@@ -82,6 +80,14 @@ def render(
     """
     state.quiet = quiet
     state.debug = debug
+
+    # 渲染管线依赖的 jinja2 / yaml 等重量级模块延迟到这里导入，
+    # 使 --help 和参数校验失败等路径无需承担它们的导入开销
+    from concurrent.futures import ThreadPoolExecutor
+    from .config import load_raw_context, execute_plan, has_dynamic_values
+    from .processor import process_value
+    from .tracker import discover_required_vars
+    from .templating import TemplateRecord, create_environment, literal_output
     
     project_root = directory if directory else Path.cwd()
     
@@ -96,130 +102,108 @@ def render(
         rich_echo("[错误] 不能同时从 stdin 和 -t/--template 提供模板。", fg=typer.colors.RED)
         raise typer.Exit(1)
         
-    # --- Step 2: Load Raw Config ---
-    raw_context, repo_root = load_raw_context(
-        project_root,
-        no_project_config,
-        global_config_paths or [],
-        config_paths or [],
-        repo_root_override,
-        set_vars or []
-    )
-    
-    # --- Step 3: Dependency Discovery (Dry Run) ---
-    rich_echo("--- 1.5 依赖发现 (Dry Run) ---", bold=True)
-    tracking_context, tracker = create_tracking_context(raw_context)
-    
-    # 使用静默的 Environment 进行探测，防止报错
-    probe_env = Environment(
-        autoescape=False, 
-        undefined=SilentUndefined,
-        trim_blocks=True, 
-        lstrip_blocks=True
-    )
+    # --- Step 2: Read Templates ---
+    # 先读取模板，配置加载阶段据此跳过没有被引用的命名空间文件
+    templates_to_process: List[TemplateRecord] = []
+    template_sources = {} # 已读取的模板源码 (模板名 -> (源码, 文件名))，探测与最终渲染共用
+    load_names = {} # 源码 -> 第一个使用该源码的模板名，内容相同的模板只编译一次
 
-    templates_to_process = [] # List of (template_source, template_name_for_log, scope_override)
+    def add_template(
+        name: str, content: str, filename: Optional[str],
+        tmpl_scope: Optional[str], output_path: Optional[Path] = None
+    ):
+        template_sources[name] = (content, filename)
+        load_name = load_names.setdefault(content, name)
+        templates_to_process.append(TemplateRecord(name, content, tmpl_scope, load_name, output_path))
 
     if stdin_content is not None:
-        templates_to_process.append((stdin_content, "<stdin>", scope))
+        add_template("<stdin>", stdin_content, None, scope)
     elif template_path:
-        content = template_path.read_text('utf-8')
-        templates_to_process.append((content, str(template_path), scope))
+        content = template_path.read_bytes().decode('utf-8')
+        add_template(str(template_path), content, str(template_path.resolve()), scope)
     else:
         # Directory mode
         templates_dir = project_root / TEMPLATES_DIR_NAME
+        outputs_dir = project_root / OUTPUTS_DIR_NAME
         if templates_dir.is_dir():
-            for template_file in templates_dir.glob('**/*'):
-                if template_file.is_file():
-                    try:
-                        content = template_file.read_text('utf-8')
-                        relative_path = template_file.relative_to(templates_dir)
-                        
-                        # Determine scope
+            for rel_name, file_path in walk_files(str(templates_dir)):
+                try:
+                    # 二进制读取后一次性解码，省去文本模式的增量解码与换行转换；
+                    # Jinja 的词法分析器会自行统一换行符
+                    with open(file_path, 'rb') as f:
+                        content = f.read().decode('utf-8')
+                    # Determine scope: walk_files 产出 posix 相对路径，第一段目录即作用域
+                    dir_scope, sep, _ = rel_name.partition('/')
+                    if not sep:
                         dir_scope = None
-                        if len(relative_path.parts) > 1:
-                            dir_scope = relative_path.parts[0]
-                        
-                        templates_to_process.append((content, str(relative_path), dir_scope))
-                    except Exception as e:
-                        rich_echo(f"  [警告] 读取模板 '{template_file}' 失败: {e}", fg=typer.colors.YELLOW)
-
-    # Run discovery on all templates
-    for content, name, tmpl_scope in templates_to_process:
-        try:
-            # 1. Static Analysis: Find undeclared variables (covers top-level vars effectively)
-            # This is crucial because TrackingDict might be bypassed for top-level scalars in Jinja2 context
-            ast = probe_env.parse(content)
-            static_vars = meta.find_undeclared_variables(ast)
-            for var in static_vars:
-                tracker.accessed_paths.add(var)
+                    
+                    add_template(rel_name, content, file_path, dir_scope, outputs_dir / rel_name)
+                except Exception as e:
+                    rich_echo(f"  [警告] 读取模板 '{file_path}' 失败: {e}", fg=typer.colors.YELLOW)
 
-            # 2. Dynamic Discovery (Dry Run): Handle dynamic constructs and scope injection
-            
-            # Since scope injection is: context.update(context[scope])
-            # We can't easily deep copy TrackingDict.
-            # But we can create a temporary dict that points to the same underlying TrackingDict nodes.
-            # Actually, TrackingDict inherits from dict, so .copy() works (shallow).
-            render_ctx = tracking_context.copy()
-            
-            if tmpl_scope:
-                if tmpl_scope in render_ctx and isinstance(render_ctx[tmpl_scope], dict):
-                     render_ctx.update(render_ctx[tmpl_scope])
-            
-            probe_env.from_string(content).render(render_ctx)
-        except Exception as e:
-            rich_debug(f"[Discovery] 模板 '{name}' 探测失败: {e}")
-            # Ignore errors in dry run, maybe required vars are missing, we'll catch it in real run
-            pass
+    # 单文件模式下模板不含任何 Jinja 语法时，输出与配置无关：
+    # 除非需要按 '$' 做后处理，否则无需加载配置和解析依赖
+    if stdin_content is not None or template_path:
+        if '{' not in templates_to_process[0].source:
+            output = literal_output(templates_to_process[0].source)
+            if not output.startswith('$'):
+                rich_debug("模板不含 Jinja 语法，跳过配置加载与依赖解析")
+                print(output, end='')
+                rich_echo("\n--- ✨ 处理完毕 ---", bold=True, fg=typer.colors.BRIGHT_GREEN)
+                return
 
-    # Pruning Optimization:
-    # Remove variables that are parents of other accessed variables.
-    # This prevents full namespace loading when only specific attributes are accessed.
-    # e.g., if we have {'KOS', 'KOS.version'}, we only keep 'KOS.version'.
-    raw_vars = tracker.accessed_paths
-    required_vars = set()
-    for var in raw_vars:
-        # Keep var if it is NOT a prefix (parent) of any other variable in the set
-        # We look for "var." at the start of other variables
-        is_parent = False
-        prefix = f"{var}."
-        for other in raw_vars:
-            if other.startswith(prefix):
-                is_parent = True
-                break
-        
-        if not is_parent:
-            required_vars.add(var)
+    # --- Step 3: Load Raw Config ---
+    raw_context, repo_root = load_raw_context(
+        project_root,
+        no_project_config,
+        global_config_paths or [],
+        config_paths or [],
+        repo_root_override,
+        set_vars or [],
+        # 只有名称出现在模板源码或作用域中的命名空间才需要加载
+        referencing_texts=[*load_names, *{record.scope for record in templates_to_process if record.scope}]
+    )
+    
+    # 探测与最终渲染共用同一个 Environment：每份模板只编译一次。
+    # stdin 内容每次都不同，不值得写入磁盘字节码缓存
+    env = create_environment(template_sources, persistent_cache=stdin_content is None)
 
-    rich_debug(f"精确依赖发现结果 (优化后): {required_vars}")
+    # --- Step 3.5: Dependency Discovery (Dry Run) ---
+    rich_echo("--- 1.5 依赖发现 (Dry Run) ---", bold=True)
+    if has_dynamic_values(raw_context):
+        required_vars = discover_required_vars(raw_context, templates_to_process, env)
+    else:
+        # 配置中没有任何需要渲染、读取或执行的值，剪枝没有收益，直接跳过模板扫描
+        rich_debug("配置中不含动态值 ($, @, !, file://)，跳过依赖发现")
+        required_vars = None
 
     # --- Step 4: Execute Plan ---
     final_context = execute_plan(raw_context, repo_root, required_vars)
     
-    import json
-    rich_debug(f"最终上下文准备就绪: {json.dumps(final_context, indent=2, default=str)}")
+    # 序列化整个上下文代价不小，只在调试模式下才做
+    if state.debug:
+        import json
+        rich_debug(f"最终上下文准备就绪: {json.dumps(final_context, indent=2, default=str)}")
     
     # --- Step 5: Final Render ---
     rich_echo("--- 4. 开始渲染 ---", bold=True)
     
-    # Use standard environment for final render
-    env = Environment(autoescape=False, trim_blocks=True, lstrip_blocks=True)
-    
     if stdin_content is not None or template_path:
         # Single file mode
         # Note: We already loaded content into templates_to_process[0]
-        template_content = templates_to_process[0][0]
+        record = templates_to_process[0]
         
-        render_context = final_context.copy()
+        render_context = final_context
         if scope:
-            if scope in render_context and isinstance(render_context[scope], dict):
+            scope_data = final_context.get(scope)
+            if isinstance(scope_data, dict):
                 rich_echo(f"  应用作用域 (-s): '{scope}'")
-                render_context.update(render_context[scope])
+                render_context = {**final_context, **scope_data}
             else:
                 rich_echo(f"  [警告] 作用域 '{scope}' 在配置中不存在，已忽略。", fg=typer.colors.YELLOW)
 
         try:
-            template = env.from_string(template_content)
+            template = env.get_template(record.load_name)
             output = template.render(render_context)
             
             # --- Post-Render Evaluation ---
@@ -236,38 +220,49 @@ def render(
     else:
         # Directory mode
         templates_dir = project_root / TEMPLATES_DIR_NAME
-        outputs_dir = project_root / OUTPUTS_DIR_NAME
         
         if not templates_dir.is_dir():
             rich_echo(f"[错误] 模板目录不存在: {templates_dir}", fg=typer.colors.RED)
             raise typer.Exit(1)
         
-        env.loader = FileSystemLoader(templates_dir)
-        
-        for template_file in templates_dir.glob('**/*'):
-            if template_file.is_dir():
-                continue
+        # 直接复用读取阶段生成的记录 (源码、作用域、输出路径) 与编译结果，
+        # 无需再次遍历目录、读盘或编译
+        jobs = []
+        for record in templates_to_process:
+            # Jinja 的 render() 本身会复制传入的映射，因此只在需要注入作用域时才构造新字典
+            render_context = final_context
+            scope_applied = False
+            if record.scope:
+                scope_data = final_context.get(record.scope)
+                if isinstance(scope_data, dict):
+                    render_context = {**final_context, **scope_data}
+                    scope_applied = True
+            jobs.append((record, render_context, scope_applied))
 
-            relative_path = template_file.relative_to(templates_dir)
-            rich_echo(f"\n* 正在处理: {relative_path}")
-            
-            render_context = final_context.copy()
-            if len(relative_path.parts) > 1:
-                dir_scope = relative_path.parts[0]
-                if dir_scope in render_context and isinstance(render_context[dir_scope], dict):
-                    rich_echo(f"  -> 应用目录作用域: '{dir_scope}'")
-                    render_context.update(render_context[dir_scope])
-            
+        # 每个输出目录只创建一次，而不是每个模板都 mkdir 一遍。
+        # 创建失败时留给写文件那一步按模板报告错误
+        for output_dir in sorted({record.output_path.parent for record in templates_to_process}, key=lambda p: len(p.parts)):
             try:
-                template = env.get_template(str(relative_path))
-                output_content = template.render(render_context)
-                
-                output_path = outputs_dir / relative_path
-                output_path.parent.mkdir(parents=True, exist_ok=True)
-                output_path.write_text(output_content, encoding='utf-8')
-                rich_echo(f"  => 渲染成功: {output_path}", fg=typer.colors.GREEN)
-            except Exception as e:
-                 rich_echo(f"  [错误] 渲染模板 '{relative_path}' 失败: {e}", fg=typer.colors.RED)
+                output_dir.mkdir(parents=True, exist_ok=True)
+            except OSError:
+                pass
+
+        # 各模板互不依赖、输出文件互不相同，可以并行渲染和写盘；
+        # 日志仍在主线程按模板顺序输出
+        if len(jobs) > 1:
+            with ThreadPoolExecutor() as pool:
+                errors = list(pool.map(lambda job: _render_template_file(env, job[0], job[1]), jobs))
+        else:
+            errors = [_render_template_file(env, record, ctx) for record, ctx, _ in jobs]
+
+        for (record, _, scope_applied), error in zip(jobs, errors):
+            rich_echo(f"\n* 正在处理: {record.name}")
+            if scope_applied:
+                rich_echo(f"  -> 应用目录作用域: '{record.scope}'")
+            if error is None:
+                rich_echo(f"  => 渲染成功: {record.output_path}", fg=typer.colors.GREEN)
+            else:
+                rich_echo(f"  [错误] 渲染模板 '{record.name}' 失败: {error}", fg=typer.colors.RED)
 
     rich_echo("\n--- ✨ 处理完毕 ---", bold=True, fg=typer.colors.BRIGHT_GREEN)
 
@@ -1,74 +1,140 @@
+import os
 import yaml
 import typer
 from pathlib import Path
-from typing import List, Optional, Dict, Any, Set, Tuple
+from typing import AbstractSet, Iterator, List, Optional, Dict, Any, Tuple
 
 from .console import rich_echo, rich_debug
 from .utils import deep_merge_dicts, set_nested_key
 from .graph import DependencyGraph
 from .processor import PlanExecutor
 
+# 优先使用 libyaml 提供的 C 解析器，不可用时回退到纯 Python 实现
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
 CONFIGS_DIR_NAME = "configs"
 GLOBAL_CONFIG_FILENAME = "config.yaml"
 
+def _load_yaml(path: Path) -> Any:
+    """
+    解析一个 YAML 文件。直接把二进制文件句柄交给解析器，省去一次 UTF-8 解码。
+    """
+    with open(path, 'rb') as f:
+        return yaml.load(f, Loader=SafeLoader)
+
+def _normalize_config(content: Any) -> Dict[str, Any]:
+    """
+    把命名空间配置规整为字典：支持 list-of-dicts (如 `- version: 1.0`) 和普通字典两种写法。
+    """
+    if isinstance(content, list):
+        return {k: v for item in content if isinstance(item, dict) for k, v in item.items()}
+    if isinstance(content, dict):
+        return content
+    return {}
+
+def _merge_namespace(namespaced_contexts: Dict[str, Dict[str, Any]], prefix: str, content: Dict[str, Any]):
+    """
+    将一个文件的内容合并进对应命名空间。命名空间首次出现时直接采用该字典，
+    _load_yaml 每次都返回新对象，无需再逐键深度合并一遍。
+    """
+    current = namespaced_contexts.get(prefix)
+    if current is None:
+        namespaced_contexts[prefix] = content
+    else:
+        deep_merge_dicts(content, current)
+
+def _iter_strings(data: Any) -> Iterator[str]:
+    """
+    遍历嵌套结构中的所有字符串值。
+    """
+    stack = [data]
+    while stack:
+        current = stack.pop()
+        if isinstance(current, str):
+            yield current
+        elif isinstance(current, dict):
+            stack.extend(current.values())
+        elif isinstance(current, list):
+            stack.extend(current)
+
 def load_raw_context(
     project_root: Path,
     no_project_config: bool,
     global_config_paths: List[Path],
     config_paths: List[Path],
     repo_root_override: Optional[Path],
-    set_vars: List[str]
+    set_vars: List[str],
+    referencing_texts: Optional[List[str]] = None
 ) -> Tuple[Dict[str, Any], Path]:
     """
     Phase 1: 加载所有原始 YAML 到一个大字典 (Raw Context)。
+    提供 referencing_texts (模板源码、作用域名等) 时，只加载在其中或在已加载的配置值中
+    出现过名称的命名空间文件；为 None 时加载全部。
     返回 (raw_context, repo_root)
     """
     rich_echo("--- 1. 加载配置 (Raw Loading) ---", bold=True)
     
     raw_context = {}
     namespaced_contexts = {}
+    # 按合并顺序排列的命名空间文件: (prefix, path, 是否跳过空文件)
+    namespace_files: List[Tuple[str, Path, bool]] = []
 
     # 1.1 Project Configs
     if not no_project_config:
         global_config_file = project_root / GLOBAL_CONFIG_FILENAME
         if global_config_file.is_file():
-            raw_context = yaml.safe_load(global_config_file.read_text('utf-8')) or {}
+            raw_context = _load_yaml(global_config_file) or {}
         
         configs_dir = project_root / CONFIGS_DIR_NAME
         if configs_dir.is_dir():
-            for config_file in configs_dir.glob('*.yaml'):
-                parts = config_file.stem.split('-', 1)
-                if len(parts) > 0:
-                    prefix = parts[0]
-                    content = yaml.safe_load(config_file.read_text('utf-8'))
-                    if not content: continue
-                    
-                    # Normalize list-of-dicts to dict
-                    normalized_content = {}
-                    if isinstance(content, list):
-                        for item in content:
-                            if isinstance(item, dict): normalized_content.update(item)
-                    elif isinstance(content, dict):
-                        normalized_content = content
-                    
-                    current = namespaced_contexts.setdefault(prefix, {})
-                    namespaced_contexts[prefix] = deep_merge_dicts(normalized_content, current)
+            # 一次 scandir 即可拿到文件名和类型，无需逐个 stat。
+            # 按文件名排序，使同一命名空间下多个文件的覆盖顺序不依赖目录项顺序
+            with os.scandir(configs_dir) as it:
+                config_files = sorted(
+                    entry.path for entry in it
+                    if entry.name.endswith('.yaml') and entry.is_file()
+                )
+            for config_file in map(Path, config_files):
+                namespace_files.append((config_file.stem.split('-', 1)[0], config_file, True))
 
     # 1.2 CLI Overrides (-g, -c)
     for g_path in global_config_paths:
-        override = yaml.safe_load(g_path.read_text('utf-8')) or {}
+        override = _load_yaml(g_path) or {}
         raw_context = deep_merge_dicts(override, raw_context)
 
     for c_path in config_paths:
-        prefix = c_path.stem.split('-', 1)[0]
-        override = yaml.safe_load(c_path.read_text('utf-8')) or {}
-        if isinstance(override, list):
-            temp = {}
-            for item in override: temp.update(item)
-            override = temp
-            
-        current = namespaced_contexts.setdefault(prefix, {})
-        namespaced_contexts[prefix] = deep_merge_dicts(override, current)
+        namespace_files.append((c_path.stem.split('-', 1)[0], c_path, False))
+
+    def load_namespace(prefix: str) -> Iterator[str]:
+        # 按原有顺序合并该命名空间的所有文件，并产出新加载内容中的字符串供后续扫描
+        for file_prefix, path, skip_empty in namespace_files:
+            if file_prefix != prefix:
+                continue
+            content = _load_yaml(path)
+            if skip_empty and not content: continue
+            content = _normalize_config(content)
+            _merge_namespace(namespaced_contexts, prefix, content)
+            yield from _iter_strings(content)
+
+    pending = dict.fromkeys(prefix for prefix, _, _ in namespace_files)
+    if referencing_texts is None:
+        for prefix in pending:
+            for _ in load_namespace(prefix): pass
+    else:
+        # 按需加载：命名空间名称没有出现在任何模板、--set 或已加载的配置值中时，
+        # 它不可能被引用，无需解析。子串匹配是保守的，只会多加载而不会漏加载。
+        texts = [*referencing_texts, *set_vars, *_iter_strings(raw_context)]
+        while pending and texts:
+            wanted = [prefix for prefix in pending if any(prefix in text for text in texts)]
+            texts = []
+            for prefix in wanted:
+                del pending[prefix]
+                texts.extend(load_namespace(prefix))
+        if pending:
+            rich_debug(f"[Config] 未被引用的命名空间，跳过加载: {', '.join(pending)}")
 
     # Merge Namespaces into Raw Context
     raw_context.update(namespaced_contexts)
@@ -79,7 +145,8 @@ def load_raw_context(
     if 'repo_root' not in raw_context:
         raw_context['repo_root'] = str(project_root)
     
-    repo_root = Path(raw_context['repo_root']).expanduser()
+    # 在此一次性解析为绝对路径，之后的 '@' 引用只需直接拼接
+    repo_root = Path(raw_context['repo_root']).expanduser().resolve()
 
     # 1.4 Apply --set variables (Inject into Raw Context)
     if set_vars:
@@ -90,14 +157,35 @@ def load_raw_context(
     
     return raw_context, repo_root
 
+# 需要渲染、读取文件或执行命令的值的前缀
+DYNAMIC_PREFIXES = ('$', '@', '!', 'file://')
+
+def has_dynamic_values(raw_context: Dict[str, Any]) -> bool:
+    """
+    判断上下文中是否存在任何动态值 ($, @, !, file://)。
+    """
+    stack = [raw_context]
+    while stack:
+        for value in stack.pop().values():
+            if isinstance(value, dict):
+                stack.append(value)
+            elif isinstance(value, str) and value.startswith(DYNAMIC_PREFIXES):
+                return True
+    return False
+
 def execute_plan(
     raw_context: Dict[str, Any],
     repo_root: Path,
-    required_vars: Optional[Set[str]] = None
+    required_vars: Optional[AbstractSet[str]] = None
 ) -> Dict[str, Any]:
     """
     Phase 2 & 3: 构建图并执行。
     """
+    # 没有任何动态值时，执行结果就是原始上下文本身，无需为每个值解析模板和建图
+    if not has_dynamic_values(raw_context):
+        rich_debug("[Plan] 配置中不含动态值，跳过依赖图构建与执行")
+        return raw_context
+
     # --- 2. Build Graph & Plan ---
     rich_echo("--- 2. 构建依赖图 (Dependency Analysis) ---", bold=True)
     graph = DependencyGraph()
@@ -113,7 +201,7 @@ def execute_plan(
 
     # --- 3. Execute Plan ---
     rich_echo("--- 3. 执行渲染 (Deterministic Execution) ---", bold=True)
-    executor = PlanExecutor(repo_root)
+    executor = PlanExecutor(repo_root, graph.env)
     final_context = executor.execute(plan, {})
 
     return final_context
@@ -126,7 +214,7 @@ def load_and_process_configs(
     config_paths: List[Path],
     repo_root_override: Optional[Path],
     set_vars: List[str],
-    required_vars: Optional[Set[str]] = None
+    required_vars: Optional[AbstractSet[str]] = None
 ) -> Tuple[Dict[str, Any], Path]:
     
     raw_context, repo_root = load_raw_context(
@@ -1,3 +1,4 @@
+from typing import List
 import typer
 
 class State:
@@ -17,4 +18,9 @@ def rich_debug(message: str, **kwargs):
     """Prints a debug message only if debug mode is enabled."""
     if state.debug:
         # 调试信息也输出到 stderr，并带有标记和不同颜色
-        typer.secho(f"[DEBUG] {message}", err=True, fg=typer.colors.YELLOW, **kwargs)
\ No newline at end of file
+        typer.secho(f"[DEBUG] {message}", err=True, fg=typer.colors.YELLOW, **kwargs)
+
+def rich_debug_lines(messages: List[str]):
+    """Prints several debug messages with a single write, e.g. one batch per execution wave."""
+    if state.debug and messages:
+        typer.secho("\n".join(f"[DEBUG] {m}" for m in messages), err=True, fg=typer.colors.YELLOW)
@@ -1,7 +1,7 @@
-import graphlib
-from typing import Any, Dict, List, Set, Tuple, Optional
+from collections import defaultdict, deque
+from typing import AbstractSet, Any, Dict, List, Set, Tuple, Optional
 from dataclasses import dataclass
-from jinja2 import Environment, meta
+from jinja2 import Environment, meta, nodes
 from pathlib import Path
 from .console import rich_debug
 import typer
@@ -12,28 +12,42 @@ class Node:
     raw_value: Any       # e.g., "$!{{ tool }} ..."
     dependencies: Set[str]
     namespace: str       # e.g., "bug_repro" (or "" for root)
+    ast: Optional[nodes.Template] = None  # '$' 值在分析依赖时解析得到的 AST，供执行阶段直接编译
+    path_parts: Tuple[str, ...] = ()      # e.g., ("bug_repro", "command_to_run")，写回上下文时无需再拆分
 
 class DependencyGraph:
     def __init__(self):
         self.nodes: Dict[str, Node] = {}
         self.env = Environment(autoescape=False)
+        # 路径索引: 'KOS' / 'KOS.sub' -> 其下所有节点；'version' / 'sub.version' -> 以之结尾的节点
+        self._by_prefix: Dict[str, List[str]] = defaultdict(list)
+        self._by_suffix: Dict[str, List[str]] = defaultdict(list)
 
-    def _flatten_dict(self, d: Dict[str, Any], parent_key: str = '', namespace: str = '') -> List[Tuple[str, Any, str]]:
+    def _flatten_dict(self, d: Dict[str, Any]) -> List[Tuple[str, Tuple[str, ...], Any, str]]:
         """
-        递归地将嵌套字典扁平化为 (key_path, value, namespace) 的列表。
-        namespace 仅在顶层确定，后续递归保持不变。
+        将嵌套字典扁平化为 (key_path, path_parts, value, namespace) 的列表。
+        namespace 仅在顶层确定，后续层级保持不变。
+        使用显式的迭代器栈代替递归，输出顺序与深度优先的递归实现一致。
         """
         items = []
-        for k, v in d.items():
-            new_key = f"{parent_key}.{k}" if parent_key else k
-            
-            # 确定命名空间：如果是顶层键，它就是命名空间；否则沿用父级的
-            current_ns = k if parent_key == '' else namespace
-            
-            if isinstance(v, dict):
-                items.extend(self._flatten_dict(v, new_key, current_ns))
+        stack = [(iter(d.items()), '', (), '')]
+        while stack:
+            entries, parent_key, parent_parts, namespace = stack[-1]
+            for k, v in entries:
+                new_key = f"{parent_key}.{k}" if parent_key else k
+                # 与按 '.' 拆分 key_path 的结果保持一致
+                new_parts = parent_parts + tuple(str(k).split('.'))
+                
+                # 确定命名空间：如果是顶层键，它就是命名空间；否则沿用父级的
+                current_ns = namespace if parent_key else k
+                
+                if isinstance(v, dict):
+                    # 先处理子字典，处理完后回到当前迭代器继续
+                    stack.append((iter(v.items()), new_key, new_parts, current_ns))
+                    break
+                items.append((new_key, new_parts, v, current_ns))
             else:
-                items.append((new_key, v, current_ns))
+                stack.pop()
         return items
 
     def build(self, context: Dict[str, Any]):
@@ -46,12 +60,21 @@ class DependencyGraph:
         flat_items = self._flatten_dict(context)
         
         # Step 1: Create Nodes
-        for key_path, value, ns in flat_items:
+        for key_path, path_parts, value, ns in flat_items:
             # 初始时不解析依赖，只存储基本信息
-            self.nodes[key_path] = Node(key_path, value, set(), ns)
+            self.nodes[key_path] = Node(key_path, value, set(), ns, path_parts=path_parts)
+
+        # 为前缀 / 后缀匹配建立索引，之后的查找无需遍历全部节点
+        for key_path in self.nodes:
+            parts = key_path.split('.')
+            for i in range(1, len(parts)):
+                self._by_prefix['.'.join(parts[:i])].append(key_path)
+                self._by_suffix['.'.join(parts[i:])].append(key_path)
 
         # Step 2: Resolve Dependencies & Link
-        all_keys = set(self.nodes.keys())
+        all_keys = self.nodes
+        # 模板源码 -> (AST, 未声明变量)；配置中重复出现的字符串只解析一次
+        parsed: Dict[str, Tuple[nodes.Template, Set[str]]] = {}
 
         for node in self.nodes.values():
             if not isinstance(node.raw_value, str):
@@ -64,13 +87,23 @@ class DependencyGraph:
             if node.raw_value.startswith('$'):
                 template_src = node.raw_value[1:]
             
-            try:
-                ast = self.env.parse(template_src)
-                raw_vars = meta.find_undeclared_variables(ast)
-            except Exception as e:
-                rich_debug(f"[Graph] 解析模板失败 '{node.key_path}': {e}")
+            # 不含 '{' 的字符串不可能引用变量，无需解析
+            if '{' not in template_src:
                 continue
 
+            cached = parsed.get(template_src)
+            if cached is None:
+                try:
+                    ast = self.env.parse(template_src)
+                    cached = parsed[template_src] = (ast, meta.find_undeclared_variables(ast))
+                except Exception as e:
+                    rich_debug(f"[Graph] 解析模板失败 '{node.key_path}': {e}")
+                    continue
+            ast, raw_vars = cached
+
+            if template_src is not node.raw_value:
+                node.ast = ast
+
             for var in raw_vars:
                 # 依赖解析策略：
                 # 1. 尝试在同命名空间下查找 (e.g. bug_repro.target -> bug_repro.tool)
@@ -79,6 +112,11 @@ class DependencyGraph:
                     if sibling in all_keys:
                         node.dependencies.add(sibling)
                         continue # 找到即止
+                    # 同命名空间下的子字典 (e.g. A.label 引用 {{ sub.x }} -> A.sub.x)
+                    nested = self._by_prefix.get(sibling)
+                    if nested:
+                        node.dependencies.update(k for k in nested if k != node.key_path)
+                        continue
 
                 # 2. 尝试全局查找 (e.g. tool_path)
                 if var in all_keys:
@@ -87,21 +125,18 @@ class DependencyGraph:
 
                 # 3. 尝试作为命名空间前缀查找 (e.g. var="KOS" -> matches "KOS.version")
                 # 这对于引用整个对象至关重要
-                found_prefix = False
-                for key in all_keys:
-                    if key.startswith(f"{var}."):
-                        node.dependencies.add(key)
-                        found_prefix = True
-                
-                if found_prefix:
-                    continue
+                # 节点自身也可能落在该前缀下 (e.g. deep.w 引用 {{ deep.name }})，不能依赖自己
+                children = self._by_prefix.get(var)
+                if children:
+                    node.dependencies.update(k for k in children if k != node.key_path)
 
-    def _get_required_subgraph(self, target_keys: Optional[Set[str]]) -> Set[str]:
+    def _get_required_subgraph(self, target_keys: Optional[AbstractSet[str]]) -> Set[str]:
         """
         计算目标节点所需的最小子图（所有上游依赖）。
-        如果 target_keys 为 None 或空，返回所有节点（全量模式）。
+        如果 target_keys 为 None，返回所有节点（全量模式）；
+        空集合表示模板没有引用任何变量，此时无需计算任何节点。
         """
-        if not target_keys:
+        if target_keys is None:
             return set(self.nodes.keys())
 
         required_nodes = set()
@@ -117,13 +152,10 @@ class DependencyGraph:
             
             # Case B: Prefix match (Requesting a namespace)
             # e.g. req="KOS" -> matches "KOS.version", "KOS.author"
-            for node_key in self.nodes:
-                if node_key.startswith(f"{req}."):
-                    initial_nodes.add(node_key)
-                # Case C: Suffix match (Scope injection shortcut)
-                # e.g. req="version" -> matches "KOS.version"
-                elif node_key.endswith(f".{req}"):
-                    initial_nodes.add(node_key)
+            initial_nodes.update(self._by_prefix.get(req, ()))
+            # Case C: Suffix match (Scope injection shortcut)
+            # e.g. req="version" -> matches "KOS.version"
+            initial_nodes.update(self._by_suffix.get(req, ()))
 
         stack = list(initial_nodes)
         
@@ -142,7 +174,7 @@ class DependencyGraph:
         
         return required_nodes
 
-    def get_execution_plan(self, required_vars: Optional[Set[str]] = None) -> List[Node]:
+    def get_execution_plan(self, required_vars: Optional[AbstractSet[str]] = None) -> List[Node]:
         """
         执行拓扑排序，返回按执行顺序排列的节点列表。
         支持按需加载：如果提供了 required_vars，只包含计算这些变量所需的节点。
@@ -151,25 +183,44 @@ class DependencyGraph:
         relevant_keys = self._get_required_subgraph(required_vars)
         rich_debug(f"[Graph] 剪枝优化: 从 {len(self.nodes)} 个节点减少到 {len(relevant_keys)} 个")
 
-        # 2. 构建排序器
-        sorter = graphlib.TopologicalSorter()
-        
-        for key in relevant_keys:
-            node = self.nodes[key]
-            # 只添加也在 relevant_keys 中的依赖
-            # 过滤掉不在子图中的外部依赖（如果有的话）
-            deps = {d for d in node.dependencies if d in relevant_keys}
-            sorter.add(key, *deps)
-
-        try:
-            sorted_keys = list(sorter.static_order())
-        except graphlib.CycleError as e:
-            cycle = " -> ".join(e.args[1])
+        # 2. Kahn 算法：按入度逐层弹出节点，直接生成计划
+        # 按节点的插入顺序 (即配置中的出现顺序) 处理，结果是确定的
+        keys = [k for k in self.nodes if k in relevant_keys]
+        in_degree: Dict[str, int] = {}
+        dependents: Dict[str, List[str]] = defaultdict(list)
+        for key in keys:
+            # 只统计也在 relevant_keys 中的依赖，过滤掉不在子图中的外部依赖
+            deps = [d for d in self.nodes[key].dependencies if d in relevant_keys]
+            in_degree[key] = len(deps)
+            for dep in deps:
+                dependents[dep].append(key)
+
+        ready = deque(k for k in keys if in_degree[k] == 0)
+        plan = []
+        while ready:
+            key = ready.popleft()
+            plan.append(self.nodes[key])
+            for dependent in dependents.get(key, ()):
+                in_degree[dependent] -= 1
+                if in_degree[dependent] == 0:
+                    ready.append(dependent)
+
+        if len(plan) != len(keys):
+            cycle = " -> ".join(self._find_cycle({k for k, d in in_degree.items() if d > 0}))
             raise typer.BadParameter(f"检测到循环依赖: {cycle}")
 
-        plan = []
-        for key in sorted_keys:
-            if key in self.nodes:
-                plan.append(self.nodes[key])
-        
-        return plan
\ No newline at end of file
+        return plan
+
+    def _find_cycle(self, remaining: Set[str]) -> List[str]:
+        """
+        在 Kahn 算法未能弹出的节点中找出一个环，返回 [a, b, ..., a] 形式的路径。
+        这些节点的入度都不为零，沿着仍未弹出的依赖一直走下去必然会回到走过的节点。
+        """
+        path: List[str] = []
+        position: Dict[str, int] = {}
+        current = next(iter(remaining))
+        while current not in position:
+            position[current] = len(path)
+            path.append(current)
+            current = next(d for d in self.nodes[current].dependencies if d in remaining)
+        return path[position[current]:] + [current]
@@ -1,21 +1,106 @@
+import os
 import sys
+import stat
+import mmap
+import functools
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Optional, Dict, List
-from urllib.parse import urlparse, unquote
-from jinja2 import Environment
+from typing import Any, Optional, Dict, List, Tuple
+from urllib.parse import unquote
+from jinja2 import Environment, Template
 import typer
 
-from .console import rich_echo, rich_debug
-from .utils import set_nested_key
+from .console import state, rich_echo, rich_debug, rich_debug_lines
+from .utils import set_nested_key_parts
 from .graph import Node
+from .templating import literal_output
+
+# 需要文件读取或命令执行的特殊值前缀
+_IO_PREFIXES = ('@', '!', 'file://')
+
+# 超过该大小的文件通过 mmap 直接解码，避免先复制出一份 bytes
+_MMAP_THRESHOLD = 64 * 1024
+
+@functools.lru_cache(maxsize=256)
+def _read_text(path: str, mtime_ns: int, size: int) -> str:
+    """
+    读取并解码文件内容。以 (路径, mtime, 大小) 为键缓存，
+    同一文件被多个变量引用时只读取一次，文件变化后自动失效。
+    """
+    with open(path, 'rb') as f:
+        if size >= _MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                text = str(mm, 'utf-8')
+        else:
+            text = f.read().decode('utf-8')
+    # 与文本模式读取保持一致：统一换行符
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text
+
+def _read_file(file_path_to_read: str) -> Any:
+    rich_debug(f"[Executor] 读取文件: {file_path_to_read}")
+    # 一次 stat 同时完成存在性检查和缓存键计算；只有出错时才解析绝对路径。
+    # 路径全程以字符串处理，不为每个值构造 Path 对象
+    try:
+        st = os.stat(file_path_to_read)
+    except OSError:
+        st = None
+    if st is None or not stat.S_ISREG(st.st_mode):
+        return f"<Error: File not found {os.path.realpath(file_path_to_read)}>"
+    try:
+        return _read_text(file_path_to_read, st.st_mtime_ns, st.st_size)
+    except Exception as e:
+        rich_echo(f"[错误] 读取文件失败: {e}", fg=typer.colors.RED)
+        return str(e)
+
+def _handle_file_uri(rest: str, repo_root: Optional[Path]) -> Any:
+    """file://<path>：绝对路径，或相对于当前工作目录的路径。"""
+    # 与 urlparse 的结果一致：丢弃 fragment 和 query，其余部分 (netloc + path) 即为路径
+    path_str = rest.partition('#')[0].partition('?')[0]
+    if '%' in path_str:
+        path_str = unquote(path_str)
+    if sys.platform == "win32" and path_str.startswith('/') and ":" in path_str:
+        path_str = path_str[1:]
+    return _read_file(path_str if os.path.isabs(path_str) else os.path.join(os.getcwd(), path_str))
+
+def _handle_at_ref(rest: str, repo_root: Optional[Path]) -> Any:
+    """@<path>：相对于 repo_root 的路径。"""
+    if not repo_root:
+        return f"<Error: repo_root undefined>"
+    return _read_file(os.path.join(repo_root, rest.lstrip('/')))
+
+def _handle_command(command: str, repo_root: Optional[Path]) -> Any:
+    """!<command>：执行 shell 命令，返回其标准输出。"""
+    rich_debug(f"[Executor] 执行命令: {command}")
+    try:
+        exec_cwd = repo_root if (repo_root and repo_root.is_dir()) else None
+        result = subprocess.run(
+            command, shell=True, capture_output=True, text=True, check=True, encoding='utf-8', cwd=exec_cwd
+        )
+        return result.stdout.strip()
+    except subprocess.CalledProcessError as e:
+        rich_echo(f"[错误] 命令执行失败 '{command}': {e.stderr}", fg=typer.colors.RED)
+        return f"<Error: Command failed>"
+    except Exception as e:
+        rich_echo(f"[错误] 命令执行异常: {e}", fg=typer.colors.RED)
+        return str(e)
+
+# 特殊值前缀 -> 处理函数；按顺序匹配第一个命中的前缀
+_PREFIX_HANDLERS = (
+    ('file://', _handle_file_uri),
+    ('@', _handle_at_ref),
+    ('!', _handle_command),
+)
 
 def process_value(key: str, value: Any, repo_root: Optional[Path]) -> Any:
     """
     处理特殊值 (@, file://, !).
     此时 value 应当已经是经 Jinja2 渲染后的干净字符串，不应包含 {{ }}.
     """
-    if not isinstance(value, str):
+    # 绝大多数值不带特殊前缀：一次 startswith(tuple) 判断后直接返回
+    if not isinstance(value, str) or not value.startswith(_IO_PREFIXES):
         return value
 
     # 最后的安全防线：绝对禁止执行未渲染的模板
@@ -23,97 +108,142 @@ def process_value(key: str, value: Any, repo_root: Optional[Path]) -> Any:
         rich_debug(f"[Security] 拦截了包含未解析模板的操作: {key} = {value}")
         return value
 
-    # 1. 处理文件读取 (@, file://)
-    file_path_to_read = None
-    if value.startswith('file://'):
-        parsed_uri = urlparse(value)
-        path_str = unquote(parsed_uri.netloc + parsed_uri.path)
-        if sys.platform == "win32" and path_str.startswith('/') and ":" in path_str:
-            path_str = path_str[1:]
-        path_obj = Path(path_str)
-        file_path_to_read = path_obj if path_obj.is_absolute() else Path.cwd() / path_obj
-
-    if value.startswith('@'):
-        if not repo_root:
-            return f"<Error: repo_root undefined>"
-        file_path_to_read = (repo_root / value[1:].lstrip('/')).resolve()
-
-    if file_path_to_read:
-        rich_debug(f"[Executor] 读取文件: {file_path_to_read}")
-        if file_path_to_read.is_file():
-            try:
-                return file_path_to_read.read_text(encoding='utf-8')
-            except Exception as e:
-                rich_echo(f"[错误] 读取文件失败: {e}", fg=typer.colors.RED)
-                return str(e)
-        return f"<Error: File not found {file_path_to_read}>"
-
-    # 2. 处理命令执行 (!)
-    if value.startswith('!'):
-        command = value[1:]
-        rich_debug(f"[Executor] 执行命令: {command}")
-        try:
-            exec_cwd = repo_root if (repo_root and repo_root.is_dir()) else None
-            result = subprocess.run(
-                command, shell=True, capture_output=True, text=True, check=True, encoding='utf-8', cwd=exec_cwd
-            )
-            return result.stdout.strip()
-        except subprocess.CalledProcessError as e:
-            rich_echo(f"[错误] 命令执行失败 '{command}': {e.stderr}", fg=typer.colors.RED)
-            return f"<Error: Command failed>"
-        except Exception as e:
-            rich_echo(f"[错误] 命令执行异常: {e}", fg=typer.colors.RED)
-            return str(e)
+    for prefix, handler in _PREFIX_HANDLERS:
+        if value.startswith(prefix):
+            return handler(value[len(prefix):], repo_root)
 
     return value
 
 class PlanExecutor:
-    def __init__(self, repo_root: Optional[Path]):
+    def __init__(self, repo_root: Optional[Path], env: Optional[Environment] = None):
         self.repo_root = repo_root
-        self.env = Environment(autoescape=False)
+        # 传入 DependencyGraph 的 Environment，即可直接编译它解析好的 AST
+        self.env = env or Environment(autoescape=False)
         self.final_context: Dict[str, Any] = {}
+        # 本次执行中已处理过的特殊值 (!, @, file://) -> 结果
+        self._resolved: Dict[str, Any] = {}
+        # 本次执行中已渲染的 '$' 值: (模板源码, 注入的命名空间) -> 渲染结果
+        self._rendered: Dict[Tuple[str, Optional[str]], str] = {}
+        # 已编译的 '$' 模板: 模板源码 -> Template，相同源码只编译一次
+        self._templates: Dict[str, Template] = {}
+
+    @staticmethod
+    def _group_into_waves(plan: List[Node]) -> List[List[Node]]:
+        """
+        将拓扑有序的计划按依赖深度分层。同一层内的节点互不依赖，可以并发处理。
+        """
+        levels: Dict[str, int] = {}
+        waves: List[List[Node]] = []
+        for node in plan:
+            level = 1 + max((levels[d] for d in node.dependencies if d in levels), default=-1)
+            levels[node.key_path] = level
+            if level == len(waves):
+                waves.append([])
+            waves[level].append(node)
+        return waves
+
+    def _render(self, node: Node) -> Any:
+        """
+        如果是动态值 ($)，先进行 Jinja2 渲染；否则原样返回。
+        """
+        value_to_process = node.raw_value
+        if not (isinstance(value_to_process, str) and value_to_process.startswith('$')):
+            return value_to_process
+
+        template_src = value_to_process[1:]
+        # 没有 '{' 就不可能有 {{ }} / {% %} / {# #}，无需经过 Jinja
+        if '{' not in template_src:
+            return literal_output(template_src)
+
+        # 构造渲染上下文：全局上下文 + 命名空间注入
+        # 只有需要注入命名空间时才构造新字典，{**a, **b} 一步完成合并
+        render_ctx = self.final_context
+        scope = None
+        if node.namespace:
+            ns_data = self.final_context.get(node.namespace)
+            if isinstance(ns_data, dict):
+                render_ctx = {**self.final_context, **ns_data}
+                scope = node.namespace
+
+        # 源码和注入的命名空间都相同的节点依赖集合也相同，且依赖在渲染前都已写入上下文，
+        # 因此渲染结果必然一致，可以直接复用
+        memo_key = (template_src, scope)
+        if memo_key in self._rendered:
+            return self._rendered[memo_key]
+
+        try:
+            template = self._templates.get(template_src)
+            if template is None:
+                # 依赖分析阶段已经解析过的 AST 可以直接编译，免去再解析一遍
+                source = node.ast if node.ast is not None else template_src
+                template = self._templates[template_src] = self.env.from_string(source)
+            rendered = self._rendered[memo_key] = template.render(render_ctx)
+            return rendered
+        except Exception as e:
+            rich_echo(f"[警告] 渲染变量 '{node.key_path}' 失败: {e}", fg=typer.colors.YELLOW)
+            # 失败时保留原始值（去除 $），方便调试
+            return template_src
 
     def execute(self, plan: List[Node], initial_context: Dict[str, Any]) -> Dict[str, Any]:
         """
         严格按照计划顺序执行。
+        同一依赖层内需要 I/O 的值 (!, @, file://) 会在线程池中并发处理，
+        结果仍按计划顺序写回上下文。相同的特殊值在一次执行中只会被处理一次。
         """
         self.final_context = initial_context.copy()
+        self._resolved = {}
+        self._rendered = {}
         
         rich_debug(f"[Executor] 开始执行计划，共 {len(plan)} 个节点")
 
-        for node in plan:
-            value_to_process = node.raw_value
-
-            # --- 阶段 1: 渲染 (如果需要) ---
-            # 如果是动态值，先进行 Jinja2 渲染
-            if isinstance(value_to_process, str) and value_to_process.startswith('$'):
-                template_src = value_to_process[1:]
-                
-                # 构造渲染上下文：全局上下文 + 命名空间注入
-                render_ctx = self.final_context.copy()
-                if node.namespace and node.namespace in self.final_context:
-                    ns_data = self.final_context[node.namespace]
-                    if isinstance(ns_data, dict):
-                        render_ctx.update(ns_data)
-                
-                try:
-                    # 渲染
-                    value_to_process = self.env.from_string(template_src).render(render_ctx)
-                except Exception as e:
-                    rich_echo(f"[警告] 渲染变量 '{node.key_path}' 失败: {e}", fg=typer.colors.YELLOW)
-                    # 失败时保留原始值（去除 $），方便调试
-                    value_to_process = template_src
-
-            # --- 阶段 2: 执行 (如果需要) ---
-            # 将渲染后的结果（或原始值）交给 process_value 处理 !, @, file:// 等
-            final_val = process_value(node.key_path, value_to_process, self.repo_root)
-            
-            # --- 阶段 3: 写回上下文 ---
-            set_nested_key(self.final_context, node.key_path, final_val)
-            
-            # 调试日志
-            val_preview = str(final_val)
-            if len(val_preview) > 50: val_preview = val_preview[:50] + "..."
-            rich_debug(f"  -> [{node.key_path}] = {val_preview}")
-
-        return self.final_context
\ No newline at end of file
+        pool: Optional[ThreadPoolExecutor] = None
+        try:
+            for wave in self._group_into_waves(plan):
+                # --- 阶段 1: 渲染 (如果需要) ---
+                values = [self._render(node) for node in wave]
+
+                # --- 阶段 2: 执行 (如果需要) ---
+                # 将渲染后的结果（或原始值）交给 process_value 处理 !, @, file:// 等
+                io_jobs = [
+                    i for i, value in enumerate(values)
+                    if isinstance(value, str) and value.startswith(_IO_PREFIXES)
+                ]
+                # 相同的值在一次执行中只处理一次 (value -> 第一个需要它的节点)
+                pending: Dict[str, int] = {}
+                for i in io_jobs:
+                    if values[i] not in self._resolved and values[i] not in pending:
+                        pending[values[i]] = i
+                if len(pending) > 1:
+                    if pool is None:
+                        pool = ThreadPoolExecutor()
+                    futures = {
+                        value: pool.submit(process_value, wave[i].key_path, value, self.repo_root)
+                        for value, i in pending.items()
+                    }
+                    for value, future in futures.items():
+                        self._resolved[value] = future.result()
+                else:
+                    for value, i in pending.items():
+                        self._resolved[value] = process_value(wave[i].key_path, value, self.repo_root)
+
+                results = list(values)
+                for i in io_jobs:
+                    results[i] = self._resolved[values[i]]
+
+                # --- 阶段 3: 写回上下文 ---
+                for node, final_val in zip(wave, results):
+                    set_nested_key_parts(self.final_context, node.path_parts, final_val)
+
+                # 调试日志：每层汇总后一次性输出
+                if state.debug:
+                    debug_lines = []
+                    for node, final_val in zip(wave, results):
+                        val_preview = str(final_val)
+                        if len(val_preview) > 50: val_preview = val_preview[:50] + "..."
+                        debug_lines.append(f"  -> [{node.key_path}] = {val_preview}")
+                    rich_debug_lines(debug_lines)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        return self.final_context
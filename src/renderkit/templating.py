@@ -0,0 +1,132 @@
+import os
+from dataclasses import dataclass
+from hashlib import sha1
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from jinja2 import BytecodeCache, Environment, FileSystemBytecodeCache, FunctionLoader, nodes
+from jinja2.bccache import Bucket
+
+from .console import rich_debug
+
+@dataclass
+class TemplateRecord:
+    name: str             # e.g., "KOS/tool.md" (用于日志与输出路径)
+    source: str
+    scope: Optional[str]  # 渲染时注入的作用域
+    load_name: str        # 从加载器获取模板时使用的名称；内容相同的模板共用第一个
+    output_path: Optional[Path] = None  # 目录模式下的输出文件；单文件模式输出到 stdout
+
+def _cache_dir() -> str:
+    """
+    renderkit 专用的字节码缓存目录 ($XDG_CACHE_HOME/renderkit/bytecode)。
+    不与其他基于 Jinja 的工具共用默认的临时目录，避免读到按不同选项编译的字节码。
+    """
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "renderkit", "bytecode")
+
+class LayeredBytecodeCache(BytecodeCache):
+    """
+    两级字节码缓存：先查进程内缓存，再查 renderkit 专用的磁盘缓存目录。
+    依赖探测 (Dry Run) 与最终渲染加载同一模板时，第二次加载直接复用第一次的编译结果；
+    磁盘缓存则让编译结果在多次运行之间复用。
+    磁盘层在第一次需要时才创建；缓存目录不可用或读写出错时只退回进程内缓存，不影响渲染。
+    Jinja 的缓存键只包含模板名、文件名和源码，key_salt 用于把 Environment 的选项也纳入其中。
+    """
+    def __init__(self, persistent: bool = True, key_salt: str = ""):
+        self.persistent = persistent
+        self.key_salt = key_salt
+        self._memory: Dict[str, bytes] = {}
+        self._disk: Optional[FileSystemBytecodeCache] = None
+
+    def _disk_cache(self) -> Optional[FileSystemBytecodeCache]:
+        if self._disk is None and self.persistent:
+            try:
+                directory = _cache_dir()
+                os.makedirs(directory, mode=0o700, exist_ok=True)
+                self._disk = FileSystemBytecodeCache(directory)
+            except (OSError, RuntimeError) as e:
+                rich_debug(f"[Cache] 磁盘字节码缓存不可用，仅使用进程内缓存: {e}")
+                self.persistent = False
+        return self._disk
+
+    def get_cache_key(self, name: str, filename: Optional[str] = None) -> str:
+        key = super().get_cache_key(name, filename)
+        return sha1(f"{key}|{self.key_salt}".encode("utf-8")).hexdigest()
+
+    def load_bytecode(self, bucket: Bucket) -> None:
+        data = self._memory.get(bucket.key)
+        if data is not None:
+            bucket.bytecode_from_string(data)
+            return
+        disk = self._disk_cache()
+        if disk is None:
+            return
+        try:
+            disk.load_bytecode(bucket)
+        except Exception as e:
+            # 缓存文件损坏或无法读取时当作未命中，重新编译
+            rich_debug(f"[Cache] 读取字节码缓存失败: {e}")
+            bucket.reset()
+
+    def dump_bytecode(self, bucket: Bucket) -> None:
+        self._memory[bucket.key] = bucket.bytecode_to_string()
+        disk = self._disk_cache()
+        if disk is None:
+            return
+        try:
+            disk.dump_bytecode(bucket)
+        except Exception as e:
+            rich_debug(f"[Cache] 写入字节码缓存失败: {e}")
+
+class _TemplateEnvironment(Environment):
+    """
+    记住 parse() 得到的 AST：依赖探测先解析模板做静态分析，随后首次编译同一份源码时
+    直接使用这份 AST，而不是再解析一遍。AST 在编译时会被常量折叠改写，因此只用一次。
+    overlay 与原 Environment 共享同一个字典。
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._parsed_asts: Dict[str, nodes.Template] = {}
+
+    def parse(self, source, name=None, filename=None):
+        ast = super().parse(source, name, filename)
+        self._parsed_asts[source] = ast
+        return ast
+
+    def _parse(self, source, name, filename):
+        ast = self._parsed_asts.pop(source, None)
+        if ast is None:
+            ast = super()._parse(source, name, filename)
+        return ast
+
+def literal_output(text: str) -> str:
+    """
+    不含 '{' (因而没有任何 Jinja 语法) 的模板的渲染结果，无需经过 Jinja：
+    与 Jinja 一致，统一换行符并去掉末尾的一个换行。
+    """
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text[:-1] if text.endswith('\n') else text
+
+def create_environment(
+    template_sources: Dict[str, Tuple[str, Optional[str]]],
+    persistent_cache: bool = True
+) -> Environment:
+    """
+    创建渲染用的 Environment。模板从已读取到内存的源码 (名称 -> (源码, 文件名)) 加载，
+    不再访问磁盘；依赖探测可以通过 overlay 复用同一个加载器和字节码缓存。
+    """
+    def load_source(name: str):
+        entry = template_sources.get(name)
+        if entry is None:
+            return None
+        source, filename = entry
+        return source, filename, lambda: True
+
+    options = dict(autoescape=False, trim_blocks=True, lstrip_blocks=True)
+    return _TemplateEnvironment(
+        loader=FunctionLoader(load_source),
+        # 选项不同，编译出的字节码也不同，因此把选项纳入缓存键
+        bytecode_cache=LayeredBytecodeCache(persistent_cache, key_salt=repr(sorted(options.items()))),
+        **options,
+    )
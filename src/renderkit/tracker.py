@@ -1,30 +1,51 @@
-from typing import Any, Dict, Set, Optional
+from typing import AbstractSet, Any, Dict, FrozenSet, List, Set, Optional, Tuple
+from jinja2 import Environment, meta, nodes, Undefined
+
+from .console import rich_debug
+from .templating import TemplateRecord
 
 class DependencyTracker:
     def __init__(self):
-        self.accessed_paths: Set[str] = set()
+        # 路径以分段元组记录 (e.g. ('KOS', 'version'))，访问时只需在父路径后追加一段
+        self.accessed_paths: Set[Tuple[str, ...]] = set()
+
+    def dotted_paths(self) -> Set[str]:
+        """
+        把记录的路径转换为点分字符串 (e.g. 'KOS.version')。
+        """
+        return {".".join(path) for path in self.accessed_paths}
 
 class MagicDummy:
     """
     一个可以响应任意属性和索引访问的虚拟对象。
     用于在依赖追踪阶段替代不存在的值或复杂对象。
+    同一路径的子对象只创建一次，重复访问 (e.g. 循环体中的 {{ a.b }}) 直接复用。
     """
-    def __init__(self, path: str, tracker: DependencyTracker):
+    __slots__ = ('_path', '_tracker', '_children')
+
+    def __init__(self, path: Tuple[str, ...], tracker: DependencyTracker):
         self._path = path
         self._tracker = tracker
-    
+        self._children: Dict[str, "MagicDummy"] = {}
+
+    def _child(self, name: str) -> "MagicDummy":
+        child = self._children.get(name)
+        if child is None:
+            # 子对象第一次创建时记录访问，之后复用时路径必然已在集合中
+            new_path = self._path + (name,)
+            self._tracker.accessed_paths.add(new_path)
+            child = self._children[name] = MagicDummy(new_path, self._tracker)
+        return child
+
     def __getattr__(self, name: str):
-        new_path = f"{self._path}.{name}"
-        self._tracker.accessed_paths.add(new_path)
-        return MagicDummy(new_path, self._tracker)
+        return self._child(name)
     
     def __getitem__(self, key: Any):
-        new_path = f"{self._path}.{key}"
-        self._tracker.accessed_paths.add(new_path)
-        return MagicDummy(new_path, self._tracker)
+        # 以格式化后的路径段为键，不要求下标本身可哈希
+        return self._child(f"{key}")
 
     def __str__(self):
-        return f"__DUMMY_{self._path}__"
+        return f"__DUMMY_{'.'.join(self._path)}__"
     
     def __iter__(self):
         # 允许迭代，防止 {% for i in var %} 报错
@@ -37,21 +58,32 @@ class MagicDummy:
 class TrackingDict(dict):
     """
     一个包装字典，用于记录所有被访问过的键路径。
+    子字典在首次被访问时才封装为 TrackingDict，试渲染没有触及的子树无需逐键复制。
     """
-    def __init__(self, data: Dict[str, Any] = None, prefix: str = "", tracker: Optional[DependencyTracker] = None):
-        self._prefix = prefix
+    def __init__(self, data: Dict[str, Any] = None, path: Tuple[str, ...] = (), tracker: Optional[DependencyTracker] = None):
+        super().__init__(data or {})
+        self._path = path
         self._tracker = tracker
-        if data:
-            for k, v in data.items():
-                if isinstance(v, dict):
-                    # 递归封装子字典
-                    new_prefix = f"{prefix}.{k}" if prefix else k
-                    self[k] = TrackingDict(v, new_prefix, tracker)
-                else:
-                    self[k] = v
+
+    def _wrap(self, key: Any, val: Any) -> Any:
+        # 封装子字典并写回，之后的访问直接拿到同一个 TrackingDict
+        if isinstance(val, dict) and not isinstance(val, TrackingDict):
+            val = TrackingDict(val, self._path + (f"{key}",), self._tracker)
+            super().__setitem__(key, val)
+        return val
+
+    def wrap_children(self) -> "TrackingDict":
+        """
+        立即封装所有直接子字典。render() 与 ** 解包会绕过 __getitem__ 直接复制值，
+        作为渲染上下文或作用域展开之前需要先调用。
+        """
+        # 只替换已有键的值，不改变字典大小，可以边迭代边写回
+        for key, val in self.items():
+            self._wrap(key, val)
+        return self
 
     def __getitem__(self, key: str):
-        full_path = f"{self._prefix}.{key}" if self._prefix else key
+        full_path = self._path + (f"{key}",)
         
         # 1. 记录访问
         if self._tracker:
@@ -60,8 +92,8 @@ class TrackingDict(dict):
         # 2. 返回值处理
         if key in self:
             val = super().__getitem__(key)
-            if isinstance(val, TrackingDict):
-                return val
+            if isinstance(val, dict):
+                return self._wrap(key, val)
             
             # 如果是动态指令字符串（以 $ 开头），返回 Dummy 防止 Jinja 尝试解析或渲染它
             # 同时也防止副作用（虽然 Dry Run 不应该有副作用，但以防万一）
@@ -78,5 +110,168 @@ def create_tracking_context(raw_context: Dict[str, Any]) -> tuple[Dict[str, Any]
     从原始上下文创建一个追踪上下文和一个追踪器。
     """
     tracker = DependencyTracker()
-    tracking_context = TrackingDict(raw_context, prefix="", tracker=tracker)
-    return tracking_context, tracker
\ No newline at end of file
+    tracking_context = TrackingDict(raw_context, tracker=tracker).wrap_children()
+    return tracking_context, tracker
+
+# 使用一个静默的 Undefined，防止在追踪阶段因为访问了未定义变量而报错
+class SilentUndefined(Undefined):
+    # 链式访问 (e.g. {{ a.b.c }}) 都返回同一个无状态实例，不必每一级都新建对象。
+    # 迭代与 len() 沿用 Undefined 的默认实现 (空迭代、0)
+    def __getattr__(self, name):
+        return _SILENT_UNDEFINED
+    def __getitem__(self, key):
+        return _SILENT_UNDEFINED
+    def __str__(self):
+        return ""
+    def __bool__(self):
+        return False
+
+_SILENT_UNDEFINED = SilentUndefined()
+
+# 会把其他模板拉进来渲染的节点：被包含模板访问的变量无法从当前 AST 静态得出
+_CROSS_TEMPLATE_NODES = (nodes.Include, nodes.Extends, nodes.Import, nodes.FromImport)
+
+class _NeedsDryRun(Exception):
+    pass
+
+def _access_chain(node: nodes.Node) -> Optional[Tuple[str, ...]]:
+    """
+    把 X.a['b'] 这类由常量组成的访问链还原为 ('X', 'a', 'b')；链中出现非常量下标时返回 None。
+    数字等非字符串下标 (e.g. items[0]、items.0) 多半是列表索引，而列表在依赖图中是叶子节点，
+    因此访问链在此截断：X.items[0].name -> ('X', 'items')。
+    """
+    parts = []
+    while isinstance(node, (nodes.Getattr, nodes.Getitem)):
+        if isinstance(node, nodes.Getattr):
+            parts.append(node.attr)
+        elif not isinstance(node.arg, nodes.Const):
+            return None
+        elif isinstance(node.arg.value, str):
+            parts.append(node.arg.value)
+        else:
+            # 丢弃下标之后 (外层) 的部分
+            parts.clear()
+        node = node.node
+    if not isinstance(node, nodes.Name):
+        return None
+    parts.append(node.name)
+    parts.reverse()
+    return tuple(parts)
+
+def static_access_paths(ast: nodes.Template, undeclared: AbstractSet[str]) -> Optional[Set[str]]:
+    """
+    仅凭 AST 计算模板访问的变量路径 (e.g. {{ KOS.version }} -> 'KOS.version')。
+    模板含有非常量下标、include/extends/import，或者同时访问了某个对象本身和它的子路径
+    (剪枝会丢掉父路径) 时，静态结果不完整，返回 None，由调用方回退到试渲染。
+    """
+    paths: Set[str] = set()
+
+    def visit(node: nodes.Node):
+        if isinstance(node, _CROSS_TEMPLATE_NODES):
+            raise _NeedsDryRun()
+        if isinstance(node, nodes.Call) and isinstance(node.node, nodes.Getattr):
+            # 方法调用 (e.g. KOS.items()) 使用的是整个对象，而不是名为 items 的键
+            visit(node.node.node)
+            for child in node.iter_child_nodes(exclude=('node',)):
+                visit(child)
+            return
+        if isinstance(node, (nodes.Getattr, nodes.Getitem)):
+            chain = _access_chain(node)
+            if chain is None:
+                raise _NeedsDryRun()
+            if chain[0] in undeclared:
+                paths.add(".".join(chain))
+            return
+        if isinstance(node, nodes.Name):
+            if node.ctx == 'load' and node.name in undeclared:
+                paths.add(node.name)
+            return
+        for child in node.iter_child_nodes():
+            visit(child)
+
+    try:
+        visit(ast)
+    except _NeedsDryRun:
+        return None
+
+    ordered = sorted(paths, key=lambda v: v.split('.'))
+    for current, following in zip(ordered, ordered[1:]):
+        if following.startswith(f"{current}."):
+            return None
+    return paths
+
+def discover_required_vars(
+    raw_context: Dict[str, Any],
+    templates_to_process: List[TemplateRecord],
+    env: Environment
+) -> FrozenSet[str]:
+    """
+    通过静态分析和静默试渲染 (Dry Run) 找出模板实际访问的变量路径。
+    模板按名称从 env 的加载器获取，编译结果与最终渲染共享。
+    返回不可变集合，供后续剪枝做 O(1) 成员判断。
+    """
+    tracking_context, tracker = create_tracking_context(raw_context)
+    
+    # 使用静默的 overlay 进行探测，防止报错；overlay 共享加载器和字节码缓存
+    probe_env = env.overlay(undefined=SilentUndefined)
+
+    # 静态分析得到的点分路径；试渲染记录的路径最后从 tracker 合并进来
+    accessed_paths: Set[str] = set()
+
+    # Run discovery on all templates
+    probed = set()
+    for record in templates_to_process:
+        # 内容与作用域都相同的模板，探测结果必然一致
+        probe_key = (record.load_name, record.scope)
+        if probe_key in probed:
+            continue
+        probed.add(probe_key)
+        try:
+            # 1. Static Analysis: Find undeclared variables (covers top-level vars effectively)
+            # This is crucial because TrackingDict might be bypassed for top-level scalars in Jinja2 context
+            ast = probe_env.parse(record.source)
+            static_vars = meta.find_undeclared_variables(ast)
+            accessed_paths.update(static_vars)
+
+            # 访问路径能完全由 AST 确定时，无需再试渲染
+            static_paths = static_access_paths(ast, static_vars)
+            if static_paths is not None:
+                accessed_paths.update(static_paths)
+                continue
+
+            # 2. Dynamic Discovery (Dry Run): Handle dynamic constructs and scope injection
+            
+            # Since scope injection is: context.update(context[scope])
+            # Jinja copies the mapping passed to render() anyway, so only build a merged
+            # dict when a scope applies. dict.get / ** unpacking bypass TrackingDict.__getitem__,
+            # so injecting the scope itself is not recorded as an access.
+            render_ctx = tracking_context
+            if record.scope:
+                scope_data = tracking_context.get(record.scope)
+                if isinstance(scope_data, TrackingDict):
+                    render_ctx = {**tracking_context, **scope_data.wrap_children()}
+            
+            probe_env.get_template(record.load_name).render(render_ctx)
+        except Exception as e:
+            rich_debug(f"[Discovery] 模板 '{record.name}' 探测失败: {e}")
+            # Ignore errors in dry run, maybe required vars are missing, we'll catch it in real run
+            pass
+
+    # Pruning Optimization:
+    # Remove variables that are parents of other accessed variables.
+    # This prevents full namespace loading when only specific attributes are accessed.
+    # e.g., if we have {'KOS', 'KOS.version'}, we only keep 'KOS.version'.
+    #
+    # 按路径分段排序后，某个变量的所有后代都紧跟在它后面，只需检查下一个元素即可，
+    # 整体为 O(N log N)。按分段而非整串排序，是为了避免 'a-b' 这类键插在 'a' 与 'a.b' 之间。
+    accessed_paths |= tracker.dotted_paths()
+    sorted_vars = sorted(accessed_paths, key=lambda v: v.split('.'))
+    required_vars = set()
+    for i, var in enumerate(sorted_vars):
+        # Keep var if it is NOT a prefix (parent) of any other variable in the set
+        is_parent = i + 1 < len(sorted_vars) and sorted_vars[i + 1].startswith(f"{var}.")
+        if not is_parent:
+            required_vars.add(var)
+
+    rich_debug(f"精确依赖发现结果 (优化后): {required_vars}")
+    return frozenset(required_vars)
@@ -1,28 +1,60 @@
-from typing import Any, Dict
+import os
+from collections import deque
+from typing import Any, Dict, Iterator, Sequence, Tuple
 import typer
 from .console import rich_echo
-import typer
 
 def deep_merge_dicts(source: dict, destination: dict) -> dict:
     """
     深度合并两个字典。'source' 中的值会覆盖 'destination' 中的值。
+    使用显式的工作队列代替递归；'destination' 中缺失的子树直接引用 'source' 的对象，不做复制。
     """
-    for key, value in source.items():
-        if isinstance(value, dict) and key in destination and isinstance(destination[key], dict):
-            destination[key] = deep_merge_dicts(value, destination[key])
-        else:
-            destination[key] = value
+    pending = deque([(source, destination)])
+    while pending:
+        src, dst = pending.popleft()
+        for key, value in src.items():
+            if isinstance(value, dict):
+                existing = dst.get(key)
+                if isinstance(existing, dict):
+                    pending.append((value, existing))
+                    continue
+            dst[key] = value
     return destination
 
+def walk_files(root: str) -> Iterator[Tuple[str, str]]:
+    """
+    递归遍历目录，产出 (posix 风格相对路径, 绝对路径)。
+    基于 os.scandir：文件类型直接取自目录项，不需要为每个条目额外 stat。
+    与 Path.glob('**/*') 一致，不进入符号链接指向的目录。
+    """
+    pending = deque([(root, '')])
+    while pending:
+        dir_path, rel_prefix = pending.popleft()
+        with os.scandir(dir_path) as it:
+            for entry in it:
+                rel_name = rel_prefix + entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append((entry.path, rel_name + '/'))
+                elif entry.is_file():
+                    yield rel_name, entry.path
+
 def set_nested_key(d: dict, key_path: str, value: Any):
     """
     通过点分隔的路径 (e.g., 'KOS.version') 在嵌套字典中设置值。
     """
-    keys = key_path.split('.')
+    if '.' not in key_path:
+        d[key_path] = value
+        return
+    set_nested_key_parts(d, key_path.split('.'), value)
+
+def set_nested_key_parts(d: dict, parts: Sequence[str], value: Any):
+    """
+    与 set_nested_key 相同，但路径已预先拆分 (e.g., ('KOS', 'version'))。
+    """
     current_level = d
-    for i, key in enumerate(keys[:-1]):
+    for key in parts[:-1]:
         current_level = current_level.setdefault(key, {})
         if not isinstance(current_level, dict):
-            rich_echo(f"[错误] 在设置 '{key_path}' 时，路径中的 '{key}' 不是一个字典。", fg=typer.colors.RED)
+            rich_echo(f"[错误] 在设置 '{'.'.join(parts)}' 时，路径中的 '{key}' 不是一个字典。", fg=typer.colors.RED)
             return
-    current_level[keys[-1]] = value
\ No newline at end of file
+    current_level[parts[-1]] = value
@@ -1,6 +1,39 @@
 import pytest
 import yaml
 from pathlib import Path
+from unittest.mock import patch
+
+@pytest.fixture(autouse=True)
+def isolated_cache_home(tmp_path_factory, monkeypatch):
+    """Keeps the on-disk bytecode cache out of the real user cache directory."""
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path_factory.getbasetemp() / "xdg-cache"))
+
+@pytest.fixture
+def record_calls():
+    """
+    Wraps a method for the rest of the test and records every call.
+    record_calls(Environment, "compile") returns a list that collects the first
+    positional argument of each call; with result=True it collects return values instead.
+    """
+    patchers = []
+
+    def install(owner, name: str, result: bool = False) -> list:
+        calls = []
+        original = getattr(owner, name)
+
+        def wrapper(self, *args, **kwargs):
+            value = original(self, *args, **kwargs)
+            calls.append(value if result else args[0])
+            return value
+
+        patcher = patch.object(owner, name, wrapper)
+        patcher.start()
+        patchers.append(patcher)
+        return calls
+
+    yield install
+    for patcher in reversed(patchers):
+        patcher.stop()
 
 @pytest.fixture(scope="function")
 def project_dir(tmp_path: Path) -> Path:
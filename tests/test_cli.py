@@ -1,6 +1,7 @@
 import pytest
 from typer.testing import CliRunner
 from pathlib import Path
+from unittest.mock import patch
 from renderkit.cli import app
 
 runner = CliRunner()
@@ -86,4 +87,168 @@ def test_cli_set_override():
         ])
         assert result.exit_code == 0, result.output
         assert "Project: CLIProject" in result.stdout
-        assert "Version: 9.9.9" in result.stdout
\ No newline at end of file
+        assert "Version: 9.9.9" in result.stdout
+
+def test_cli_directory_render_with_include():
+    with runner.isolated_filesystem() as fs:
+        fs_path = Path(fs)
+        create_project_structure(fs_path)
+        (fs_path / "templates" / "with_include.md").write_text(
+            "Header\n{% include 'KOS/scoped.md' %}"
+        )
+
+        result = runner.invoke(app, ["--quiet"])
+
+        assert result.exit_code == 0, result.output
+        content = (fs_path / "outputs" / "with_include.md").read_text()
+        assert "Header" in content
+        assert "Scoped Version:" in content
+
+def test_cli_skips_discovery_without_dynamic_values():
+    with runner.isolated_filesystem() as fs:
+        fs_path = Path(fs)
+        create_project_structure(fs_path)
+
+        result = runner.invoke(app, ["-t", "templates/template.md", "--debug"])
+
+        assert result.exit_code == 0, result.output
+        assert "Project: TestProject" in result.stdout
+        assert "跳过依赖发现" in result.stderr
+
+def test_cli_literal_template_skips_config_loading():
+    with runner.isolated_filesystem() as fs:
+        fs_path = Path(fs)
+        create_project_structure(fs_path)
+
+        with patch("renderkit.config.load_raw_context") as mock_load:
+            result = runner.invoke(app, ["-q"], input="plain text\r\nsecond line\n")
+
+        assert result.exit_code == 0, result.output
+        # 与 Jinja 渲染结果一致：统一换行符并去掉末尾的一个换行
+        assert result.stdout == "plain text\nsecond line"
+        mock_load.assert_not_called()
+
+def test_cli_literal_dollar_template_is_still_post_processed():
+    with runner.isolated_filesystem() as fs:
+        fs_path = Path(fs)
+        create_project_structure(fs_path)
+
+        # 不含 Jinja 语法，但以 '$' 开头的输出仍需按特殊值处理
+        result = runner.invoke(app, ["-q"], input="$!echo post-processed")
+
+        assert result.exit_code == 0, result.output
+        assert result.stdout == "post-processed"
+
+def test_cli_compiles_template_once_for_probe_and_render(record_calls):
+    from jinja2 import Environment
+
+    compiled_sources = record_calls(Environment, "compile")
+
+    result = runner.invoke(
+        app,
+        ["--no-project-config", "--set", "greeting=$Hi {{ user }}", "--set", "user=tester", "-q"],
+        input="{{ greeting }}!"
+    )
+
+    assert result.exit_code == 0, result.output
+    assert result.stdout == "Hi tester!"
+    assert compiled_sources.count("{{ greeting }}!") == 1
+
+def test_cli_directory_render_compiles_duplicate_sources_once(record_calls):
+    from jinja2 import Environment
+
+    with runner.isolated_filesystem() as fs:
+        fs_path = Path(fs)
+        create_project_structure(fs_path)
+        snippet = "Snippet {{ version }} / {{ project_name }}"
+        (fs_path / "templates" / "KOS" / "a.md").write_text(snippet)
+        (fs_path / "templates" / "KOS" / "b.md").write_text(snippet)
+
+        compiled_sources = record_calls(Environment, "compile")
+        result = runner.invoke(app, ["--quiet"])
+
+        assert result.exit_code == 0, result.output
+        for name in ("a.md", "b.md"):
+            content = (fs_path / "outputs" / "KOS" / name).read_text()
+            assert content == "Snippet 1.0.0 / TestProject"
+        assert compiled_sources.count(snippet) == 1
+
+def test_cli_directory_render_normalises_crlf_templates():
+    with runner.isolated_filesystem() as fs:
+        fs_path = Path(fs)
+        create_project_structure(fs_path)
+        (fs_path / "templates" / "crlf.md").write_bytes(b"Line 1: {{ project_name }}\r\nLine 2\r\n")
+
+        result = runner.invoke(app, ["--quiet"])
+
+        assert result.exit_code == 0, result.output
+        content = (fs_path / "outputs" / "crlf.md").read_bytes()
+        assert content == b"Line 1: TestProject\nLine 2"
+
+def test_cli_parses_template_once_for_analysis_and_compile(record_calls):
+    from jinja2 import Environment
+
+    parsed_sources = record_calls(Environment, "_parse")
+
+    template = "{% set k = 'user' %}{{ greeting }} {{ names[k] }}!"
+    result = runner.invoke(
+        app,
+        ["--no-project-config", "--set", "greeting=$Hi", "--set", "names.user=tester", "-q"],
+        input=template
+    )
+
+    assert result.exit_code == 0, result.output
+    assert result.stdout == "Hi tester!"
+    assert parsed_sources.count(template) == 1
+
+def test_cli_renders_when_bytecode_cache_dir_unusable():
+    from jinja2 import FileSystemBytecodeCache
+
+    def broken_init(self, *args, **kwargs):
+        raise RuntimeError("Cannot determine safe temp directory.")
+
+    with runner.isolated_filesystem() as fs:
+        fs_path = Path(fs)
+        create_project_structure(fs_path)
+
+        with patch.object(FileSystemBytecodeCache, "__init__", broken_init):
+            result = runner.invoke(app, ["-t", "templates/template.md", "-q"])
+
+        assert result.exit_code == 0, result.output
+        assert "Project: TestProject" in result.stdout
+
+def test_cli_renders_when_bytecode_cache_io_fails():
+    from jinja2 import FileSystemBytecodeCache
+
+    def failing_io(self, bucket):
+        raise OSError("disk full")
+
+    with runner.isolated_filesystem() as fs:
+        fs_path = Path(fs)
+        create_project_structure(fs_path)
+
+        with patch.object(FileSystemBytecodeCache, "load_bytecode", failing_io), \
+             patch.object(FileSystemBytecodeCache, "dump_bytecode", failing_io):
+            result = runner.invoke(app, ["-t", "templates/template.md", "-q"])
+
+        assert result.exit_code == 0, result.output
+        assert "Project: TestProject" in result.stdout
+
+def test_cli_bytecode_cache_uses_renderkit_directory(tmp_path: Path, monkeypatch):
+    from renderkit.templating import LayeredBytecodeCache
+
+    cache_home = tmp_path / "cache"
+    monkeypatch.setenv("XDG_CACHE_HOME", str(cache_home))
+
+    with runner.isolated_filesystem() as fs:
+        fs_path = Path(fs)
+        create_project_structure(fs_path)
+
+        result = runner.invoke(app, ["-t", "templates/template.md", "-q"])
+
+        assert result.exit_code == 0, result.output
+        assert list((cache_home / "renderkit" / "bytecode").glob("__jinja2_*.cache"))
+
+    # Environment 选项不同的缓存不会共用同一个键
+    assert LayeredBytecodeCache(key_salt="a").get_cache_key("t", "f") != \
+        LayeredBytecodeCache(key_salt="b").get_cache_key("t", "f")
@@ -1,5 +1,6 @@
 from pathlib import Path
 import yaml
+from unittest.mock import patch
 from renderkit.config import load_and_process_configs
 
 def test_config_loading_basic(project_dir: Path):
@@ -87,4 +88,31 @@ def test_config_direct_command_execution(project_dir: Path):
 
     # 验证直接命令
     assert "direct_command" in context
-    assert context["direct_command"] == "Direct Execution Works"
\ No newline at end of file
+    assert context["direct_command"] == "Direct Execution Works"
+
+def test_config_static_context_skips_graph(project_dir: Path):
+    with patch("renderkit.config.DependencyGraph") as graph_cls:
+        context, _ = load_and_process_configs(project_dir, False, [], [], None, ["KOS.author=Tester"])
+
+    graph_cls.assert_not_called()
+    assert context["project_name"] == "TestProject"
+    assert context["KOS"]["author"] == "Tester"
+
+def test_config_loads_only_referenced_namespaces(project_dir: Path):
+    from renderkit.config import load_raw_context
+
+    configs_dir = project_dir / "configs"
+    # 未被引用的命名空间文件即使内容非法也不会被解析
+    (configs_dir / "UNUSED-main.yaml").write_text("key: [unterminated")
+    # SYS 只通过 KOS 中的动态值间接引用
+    (configs_dir / "KOS-extra.yaml").write_text(yaml.dump({"info": "$OS: {{ SYS.os }}"}))
+    (configs_dir / "SYS-info.yaml").write_text(yaml.dump({"os": "linux"}))
+
+    context, _ = load_raw_context(
+        project_dir, False, [], [], None, [],
+        referencing_texts=["Version: {{ KOS.version }}"]
+    )
+
+    assert context["KOS"]["version"] == "1.0.0"
+    assert context["SYS"]["os"] == "linux"
+    assert "UNUSED" not in context
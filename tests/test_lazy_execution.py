@@ -1,6 +1,7 @@
 import pytest
 from typer.testing import CliRunner
 from pathlib import Path
+from unittest.mock import MagicMock, patch
 from renderkit.cli import app
 
 runner = CliRunner()
@@ -31,6 +32,27 @@ safe_val: "I am safe"
         # 关键断言：确保 dangerous_cmd 没有被执行
         assert "命令执行失败" not in result.stderr
 
+def test_lazy_execution_spawns_no_process_for_unreferenced_commands():
+    """
+    未被引用的命令不应启动任何子进程；被引用的命令只执行一次。
+    """
+    with runner.isolated_filesystem() as fs:
+        fs_path = Path(fs)
+        (fs_path / "config.yaml").write_text("""
+unused_a: $!echo a
+unused_b: $!echo b
+used: $!echo used
+        """)
+
+        with patch("subprocess.run") as mock_run:
+            mock_run.return_value = MagicMock(stdout="used\n")
+            result = runner.invoke(app, ["-d", ".", "-q"], input="{{ used }} {{ used }}")
+
+        assert result.exit_code == 0
+        assert result.stdout == "used used"
+        mock_run.assert_called_once()
+        assert mock_run.call_args.args[0] == "echo used"
+
 def test_lazy_execution_resolves_dependencies():
     """
     测试按需执行在存在依赖时的正确性。
@@ -48,4 +70,118 @@ unused: $!exit 1
         
         assert result.exit_code == 0
         # 如果 output 包含 'Result: hello'，说明 dependency 已经被正确执行并注入
-        assert "Result: hello" in result.stdout
\ No newline at end of file
+        assert "Result: hello" in result.stdout
+
+def test_lazy_execution_skips_all_commands_for_literal_template():
+    """
+    模板不引用任何变量时，不应执行任何命令或读取任何文件。
+    """
+    with runner.isolated_filesystem() as fs:
+        fs_path = Path(fs)
+        side_effect_file = fs_path / "touched"
+
+        (fs_path / "config.yaml").write_text(f"""
+side_effect: "!touch {side_effect_file.name}"
+        """)
+
+        # 含 Jinja 语法但不引用变量：仍走配置加载，依赖发现得到空集合
+        result = runner.invoke(app, ["-d", ".", "-q"], input="{% if true %}plain text{% endif %}")
+
+        assert result.exit_code == 0
+        assert "plain text" in result.stdout
+        assert not side_effect_file.exists()
+
+def test_discovery_prunes_parent_paths():
+    """
+    父路径被访问的子路径覆盖时应被剪掉；'a-b' 这类在字典序上插在 'a' 与 'a.b' 之间的键不影响判断。
+    """
+    from renderkit.templating import TemplateRecord, create_environment
+    from renderkit.tracker import discover_required_vars
+
+    template = "{{ cfg.opt.depth }}{{ cfg['opt-b'] }}{{ other }}"
+    env = create_environment({"t": (template, None)}, persistent_cache=False)
+    raw_context = {"cfg": {"opt": {"depth": 1}, "opt-b": 2}, "other": 3}
+
+    required = discover_required_vars(raw_context, [TemplateRecord("t", template, None, "t")], env)
+
+    assert required == {"cfg.opt.depth", "cfg.opt-b", "other"}
+
+def test_discovery_tracks_nested_access_through_scope():
+    """
+    子字典按需封装后，经作用域展开的嵌套访问在试渲染中仍应被记录。
+    """
+    from renderkit.templating import TemplateRecord, create_environment
+    from renderkit.tracker import discover_required_vars
+
+    # 非常量下标使静态分析失效，必须走试渲染
+    template = "{% set k = 'x' %}{{ sub[k] }}"
+    env = create_environment({"t": (template, None)}, persistent_cache=False)
+    raw_context = {"ns": {"sub": {"x": "$a", "y": 1}}, "other": {"z": 2}}
+
+    required = discover_required_vars(raw_context, [TemplateRecord("t", template, "ns", "t")], env)
+
+    assert "ns.sub.x" in required
+    assert "ns.sub.y" not in required
+
+def test_static_access_paths():
+    """
+    只含常量访问链的模板可以直接从 AST 得到访问路径；其余情况返回 None，回退到试渲染。
+    """
+    from jinja2 import Environment, meta
+    from renderkit.tracker import static_access_paths
+
+    env = Environment()
+
+    def paths_of(source):
+        ast = env.parse(source)
+        return static_access_paths(ast, meta.find_undeclared_variables(ast))
+
+    assert paths_of("{{ KOS.version }} {{ cfg['a'].b }} {% for i in items %}{{ i.x }}{% endfor %}") == {
+        "KOS.version", "cfg.a.b", "items"
+    }
+    # 方法调用使用的是整个对象
+    assert paths_of("{% for k, v in KOS.items() %}{{ k }}{% endfor %}") == {"KOS"}
+    # 数字下标 (列表索引) 处截断：列表本身是依赖图中的叶子节点
+    assert paths_of("{{ items[0] }} {{ cfg.hosts.1 }} {{ cfg.list[2].name }}") == {
+        "items", "cfg.hosts", "cfg.list"
+    }
+    # 非常量下标、include、以及同时访问父路径与子路径，都需要试渲染
+    assert paths_of("{% set k = 'version' %}{{ KOS[k] }}") is None
+    assert paths_of("{% include 'other.md' %}") is None
+    assert paths_of("{% set alias = KOS %}{{ KOS.version }}{{ alias.author }}") is None
+
+def test_lazy_execution_keeps_list_indexed_values():
+    """
+    通过下标访问列表元素时，列表本身不能被剪掉；同时存在的动态值也应正常解析。
+    """
+    with runner.isolated_filesystem() as fs:
+        fs_path = Path(fs)
+        (fs_path / "config.yaml").write_text("""
+items: [first, second]
+cfg:
+  hosts: [a, b]
+ver: "!echo 1.2"
+        """)
+
+        result = runner.invoke(app, ["-d", ".", "-q"], input="{{ items[0] }}|{{ items.1 }}|{{ cfg.hosts[1] }}|{{ ver }}")
+
+        assert result.exit_code == 0, result.output
+        assert result.stdout == "first|second|b|1.2"
+
+def test_lazy_execution_prunes_with_static_analysis():
+    """
+    走静态分析路径时，同一命名空间中未被引用的命令同样不会被执行。
+    """
+    with runner.isolated_filesystem() as fs:
+        fs_path = Path(fs)
+        (fs_path / "configs").mkdir()
+        (fs_path / "configs" / "KOS-main.yaml").write_text("""
+version: "!echo 1.0.0"
+dangerous_cmd: "!exit 1"
+        """)
+
+        result = runner.invoke(app, ["-d", ".", "-q"], input="{{ KOS.version }}")
+
+        assert result.exit_code == 0, result.output
+        assert result.stdout == "1.0.0"
+        assert "命令执行失败" not in result.stderr
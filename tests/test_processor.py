@@ -28,4 +28,21 @@ def test_process_value_command_execution(monkeypatch):
     
     result = process_value("key", "!echo 'hello'", Path.cwd())
     assert result == "command output"
-    mock_run.assert_called_once()
\ No newline at end of file
+    mock_run.assert_called_once()
+
+def test_process_value_reads_shared_file_once(tmp_path: Path):
+    (tmp_path / "shared.txt").write_text("shared content")
+    file_uri = (tmp_path / "shared.txt").as_uri()
+
+    with patch("builtins.open", wraps=open) as mock_open:
+        assert process_value("a", "@shared.txt", tmp_path) == "shared content"
+        assert process_value("b", "@/shared.txt", tmp_path) == "shared content"
+        assert process_value("c", file_uri, None) == "shared content"
+
+    opened = [c for c in mock_open.call_args_list if str(c[0][0]).endswith("shared.txt")]
+    assert len(opened) == 1
+
+def test_process_value_large_file(tmp_path: Path):
+    content = "line\r\n" * 20000
+    (tmp_path / "large.txt").write_bytes(content.encode("utf-8"))
+    assert process_value("key", "@large.txt", tmp_path) == "line\n" * 20000
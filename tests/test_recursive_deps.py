@@ -102,4 +102,163 @@ def test_mixed_recursive_dependency(tmp_path: Path):
         
         assert context["file_ref"] == "file_content"
         # 确认最终命令执行结果被捕获
-        assert context["cmd_ref"] == "echoed_content" 
\ No newline at end of file
+        assert context["cmd_ref"] == "echoed_content" 
+
+def test_independent_commands_run_concurrently(tmp_path: Path):
+    """
+    互不依赖的命令处于同一依赖层，应当并发执行；依赖它们的命令在其后执行。
+    """
+    import threading
+    barrier = threading.Barrier(2, timeout=5)
+
+    set_vars = [
+        "first=!echo one",
+        "second=!echo two",
+        "combined=$!echo {{ first }} {{ second }}",
+    ]
+
+    with patch("subprocess.run") as mock_run:
+        def side_effect(cmd, **kwargs):
+            if cmd in ("echo one", "echo two"):
+                # 两个命令必须同时在途，否则 barrier 超时抛出 BrokenBarrierError
+                barrier.wait()
+            result = MagicMock()
+            result.stdout = cmd[len("echo "):]
+            return result
+        mock_run.side_effect = side_effect
+
+        context, _ = load_and_process_configs(tmp_path, True, [], [], tmp_path, set_vars)
+
+    assert context["first"] == "one"
+    assert context["second"] == "two"
+    assert context["combined"] == "one two"
+
+def test_identical_command_executes_once(tmp_path: Path):
+    """
+    多个变量引用同一条命令时，一次执行中命令只运行一次。
+    """
+    set_vars = [
+        "commit=!git rev-parse HEAD",
+        "KOS.commit=!git rev-parse HEAD",
+        "label=$build-{{ commit }}",
+    ]
+
+    with patch("subprocess.run") as mock_run:
+        mock_run.return_value.stdout = "abc123"
+        context, _ = load_and_process_configs(tmp_path, True, [], [], tmp_path, set_vars)
+
+    assert context["commit"] == "abc123"
+    assert context["KOS"]["commit"] == "abc123"
+    assert context["label"] == "build-abc123"
+    assert mock_run.call_count == 1
+
+def test_identical_dynamic_template_compiles_once(tmp_path: Path, record_calls):
+    """
+    多个变量使用相同的 '$' 模板源码时只编译一次，但仍按各自的命名空间渲染。
+    """
+    from jinja2 import Environment
+
+    compiled_sources = record_calls(Environment, "compile")
+
+    set_vars = [
+        "A.name=alpha",
+        "A.label=$<{{ name }}>",
+        "B.name=beta",
+        "B.label=$<{{ name }}>",
+    ]
+
+    context, _ = load_and_process_configs(tmp_path, True, [], [], tmp_path, set_vars)
+
+    assert context["A"]["label"] == "<alpha>"
+    assert context["B"]["label"] == "<beta>"
+    # 两个 '$' 值的源码相同，整个执行过程只应编译一次
+    assert len(compiled_sources) == 1
+
+def test_dynamic_template_parsed_once(tmp_path: Path, record_calls):
+    """
+    '$' 值在依赖分析时解析出的 AST 直接用于编译，不会再解析一遍。
+    """
+    from jinja2 import Environment
+
+    parsed_sources = record_calls(Environment, "_parse")
+
+    set_vars = ["name=alpha", "label=$<{{ name }}>"]
+
+    context, _ = load_and_process_configs(tmp_path, True, [], [], tmp_path, set_vars)
+
+    assert context["label"] == "<alpha>"
+    assert parsed_sources.count("<{{ name }}>") == 1
+
+def test_dependency_cycle_is_reported():
+    """
+    循环依赖应当被检测出来，并在错误信息中给出环上的路径。
+    """
+    import typer
+    from renderkit.graph import DependencyGraph
+
+    graph = DependencyGraph()
+    graph.build({"a": "$x{{ b }}", "b": "$y{{ c }}", "c": "$z{{ a }}", "d": "$ok"})
+
+    with pytest.raises(typer.BadParameter) as exc_info:
+        graph.get_execution_plan()
+
+    message = str(exc_info.value)
+    assert "检测到循环依赖" in message
+    cycle = message.split(": ", 1)[1].split(" -> ")
+    assert cycle[0] == cycle[-1]
+    assert sorted(cycle[:-1]) == ["a", "b", "c"]
+
+def test_identical_dynamic_value_renders_once(tmp_path: Path, record_calls):
+    """
+    同一作用域下源码相同的 '$' 值在一次执行中只渲染一次；不同命名空间仍各自渲染。
+    """
+    from jinja2 import Template
+
+    rendered = record_calls(Template, "render", result=True)
+
+    set_vars = [
+        "name=root",
+        "first=$<{{ name }}>",
+        "second=$<{{ name }}>",
+        "A.name=alpha",
+        "A.label=$<{{ name }}>",
+    ]
+
+    context, _ = load_and_process_configs(tmp_path, True, [], [], tmp_path, set_vars)
+
+    assert context["first"] == context["second"] == "<root>"
+    assert context["A"]["label"] == "<alpha>"
+    assert sorted(rendered) == ["<alpha>", "<root>"]
+
+def test_literal_dynamic_value_skips_jinja(tmp_path: Path, record_calls):
+    """
+    不含 Jinja 语法的 '$' 值直接取字面文本，既不解析也不编译。
+    """
+    from jinja2 import Environment
+
+    parsed_sources = record_calls(Environment, "_parse")
+
+    set_vars = ["name=alpha", "literal=$plain text", "label=$<{{ name }}>"]
+
+    context, _ = load_and_process_configs(tmp_path, True, [], [], tmp_path, set_vars)
+
+    assert context["literal"] == "plain text"
+    assert context["label"] == "<alpha>"
+    assert parsed_sources == ["<{{ name }}>"]
+
+def test_namespace_relative_nested_reference_resolves_first(tmp_path: Path):
+    """
+    '$' 值通过命名空间注入引用同命名空间下的子字典 (e.g. {{ sub.x }})，
+    或通过命名空间名引用自身所在的字典时，被引用的值必须先解析。
+    """
+    set_vars = [
+        "A.sub.x=$one",
+        "A.label=$v={{ sub.x }}",
+        "deep.name=$inner",
+        "deep.w=$({{ deep.name }})",
+    ]
+
+    context, _ = load_and_process_configs(tmp_path, True, [], [], tmp_path, set_vars)
+
+    assert context["A"]["label"] == "v=one"
+    assert context["deep"]["w"] == "(inner)"